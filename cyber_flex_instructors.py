@@ -4,7 +4,11 @@ the new instructors to ops based on assignment completion status in Canvas.
 Remove the load_dotenv lines 12 and 15 if using local variables, or pulling from the environment.
 """
 import os
+import re
+import json
+import hashlib
 import datetime
+import tempfile
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -28,6 +32,7 @@ PHASE_INSTRUCTOR_MAPPING = {
     # 'Phase 4 Complete': 'Instructor 4',
     # 'Phase 5 Complete': 'Instructor 5'
 }
+ASSIGNMENT_INDEX_FILE = 'cyber_assignment_index.json'
 
 
 def get_sheet_id_by_name(service, spreadsheet_id, sheet_name):
@@ -76,7 +81,204 @@ def get_associated_courses(course_id):
     return response.json()
 
 
-def get_students_with_assignment(course_id, assignment_name, score, days):
+def get_course_assignments(course_id):
+    """
+    Retrieves the assignments of a course from the Canvas API.
+
+    Parameters:
+    course_id (int): The ID of the course for which to fetch assignments.
+
+    Returns:
+    list: A list of assignments as JSON objects.
+    """
+    url = f'{COURSEURL}/api/v1/courses/{course_id}/assignments'
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    # Add this line to retrieve the first 200 assignments
+    params = {'per_page': 200}
+    response = requests.get(url, headers=headers, params=params, timeout=10)
+    return response.json()
+
+
+def get_blueprint_sync_marker(course_id):
+    """
+    Retrieves the ID of the most recent sync of a Blueprint course from the Canvas API.
+
+    Parameters:
+    course_id (int): The ID of the Blueprint course.
+
+    Returns:
+    int: The ID of the latest blueprint migration, or None if it was never synced.
+    """
+    url = f'{COURSEURL}/api/v1/courses/{course_id}/blueprint_templates/default/migrations'
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    params = {'per_page': 100}
+    response = requests.get(url, headers=headers, params=params, timeout=10)
+    migrations = response.json()
+    return max((migration['id'] for migration in migrations), default=None)
+
+
+def get_blueprint_survey_assignments(course_id):
+    """
+    Retrieves the blueprint template ID and the survey assignments of a Blueprint course.
+
+    Parameters:
+    course_id (int): The ID of the Blueprint course.
+
+    Returns:
+    int: The ID of the blueprint template.
+    dict: The survey assignment names keyed by their assignment ID.
+    """
+    url = f'{COURSEURL}/api/v1/courses/{course_id}/blueprint_templates/default'
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    response = requests.get(url, headers=headers, timeout=10)
+    template_id = response.json()['id']
+
+    survey_assignments = {
+        assignment['id']: assignment['name'] for assignment in get_course_assignments(course_id)
+        if assignment['name'] in PHASE_INSTRUCTOR_MAPPING
+    }
+    return template_id, survey_assignments
+
+
+def compute_migration_ids(prefix, shard_id, survey_assignments):
+    """
+    Compute the migration_ids that synced copies of the blueprint's survey assignments carry.
+
+    Canvas tags a synced copy with 'mastercourse_<shard id>_<template id>_' followed by
+    the MD5 of the original's global asset string, 'assignment_<global id>'. The API
+    returns local IDs, and the global ID is shard id * 10**13 + local ID on a sharded
+    instance, so both candidates are hashed.
+
+    Args:
+        prefix (str): The 'mastercourse_<shard id>_<template id>_' prefix of a synced copy.
+        shard_id (int): The shard ID taken from that prefix.
+        survey_assignments (dict): The survey assignment names keyed by blueprint
+        assignment ID, as returned by get_blueprint_survey_assignments().
+
+    Returns:
+        dict: The survey assignment names keyed by their candidate migration_ids.
+    """
+    migration_ids = {}
+    for assignment_id, assignment_name in survey_assignments.items():
+        for asset_id in (assignment_id, shard_id * 10 ** 13 + assignment_id):
+            asset_hash = hashlib.md5(f'assignment_{asset_id}'.encode('utf-8')).hexdigest()
+            migration_ids[prefix + asset_hash] = assignment_name
+    return migration_ids
+
+
+def load_assignment_index():
+    """
+    Load the blueprint-derived assignment ID index from 'cyber_assignment_index.json'.
+
+    An unreadable index (e.g. left half-written by a crash) is discarded and rebuilt.
+
+    Returns:
+        dict: For each blueprint course ID (as a string), the 'sync_marker' the entry
+        was built against and the survey assignment IDs of its associated 'courses'.
+    """
+    if not os.path.exists(ASSIGNMENT_INDEX_FILE):
+        return {}
+
+    with open(ASSIGNMENT_INDEX_FILE, 'r', encoding='utf-8') as file:
+        try:
+            return json.load(file)
+        except json.JSONDecodeError:
+            print(f"Rebuilding unreadable assignment index '{ASSIGNMENT_INDEX_FILE}'")
+            return {}
+
+
+def save_assignment_index(index):
+    """
+    Save the assignment ID index to 'cyber_assignment_index.json'.
+
+    The index is written to a temporary file first and then moved into place,
+    so a crash mid-write leaves the previous index intact.
+
+    Args:
+        index (dict): The index returned by load_assignment_index().
+
+    Returns:
+        None
+    """
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(ASSIGNMENT_INDEX_FILE)), suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+        json.dump(index, file)
+    os.replace(temp_path, ASSIGNMENT_INDEX_FILE)
+
+
+def resolve_survey_assignment_ids(blueprint_course, associated_courses, index):
+    """
+    Resolve the survey assignment IDs of every course associated with a Blueprint course.
+
+    The blueprint entry of the index is rebuilt whenever the blueprint has been synced
+    since it was recorded. Courses already in the entry cost no API calls; the others
+    have their assignment list fetched once and are matched to the blueprint's survey
+    assignments by migration_id. The migration_id prefix is taken from the first synced
+    copy seen, and the expected migration_ids are computed from it. When none of them
+    matches, the assignment is matched by name and its real migration_id is used for
+    later courses. Each course logs which path matched.
+
+    Args:
+        blueprint_course (int): The ID of the Blueprint course.
+        associated_courses (list): The associated courses returned by get_associated_courses().
+        index (dict): The index returned by load_assignment_index(); updated in place.
+
+    Returns:
+        dict: For each associated course ID (as a string), the survey assignment IDs
+        keyed by assignment name. Surveys missing from a course are left out.
+    """
+    sync_marker = get_blueprint_sync_marker(blueprint_course)
+    entry = index.get(str(blueprint_course))
+    if entry is None or entry['sync_marker'] != sync_marker:
+        entry = {'sync_marker': sync_marker, 'courses': {}}
+        index[str(blueprint_course)] = entry
+
+    prefix_pattern = None
+    prefix = None
+    migration_ids = {}
+    learned_ids = set()
+    for course in associated_courses:
+        if str(course['id']) in entry['courses']:
+            continue
+        if prefix_pattern is None:
+            template_id, survey_assignments = get_blueprint_survey_assignments(blueprint_course)
+            prefix_pattern = re.compile(rf'^(mastercourse_(\d+)_{template_id}_)[0-9a-f]{{32}}$')
+        assignment_ids = {}
+        matched_by = {}
+        for assignment in get_course_assignments(course['id']):
+            migration_id = assignment.get('migration_id') or ''
+            prefix_match = prefix_pattern.match(migration_id)
+            if prefix is None and prefix_match:
+                # The shard and template part of the prefix is the same for every copy
+                prefix = prefix_match.group(1)
+                migration_ids.update(compute_migration_ids(
+                    prefix, int(prefix_match.group(2)), survey_assignments))
+            assignment_name = migration_ids.get(migration_id)
+            if assignment_name is not None:
+                matched_by[assignment_name] = (
+                    'learned migration_id' if migration_id in learned_ids else 'migration_id')
+            elif assignment['name'] in PHASE_INSTRUCTOR_MAPPING:
+                assignment_name = assignment['name']
+                matched_by[assignment_name] = 'name'
+                if prefix_match:
+                    # Every synced copy of a blueprint assignment carries the same
+                    # migration_id, so later courses can match on it even if renamed
+                    migration_ids[migration_id] = assignment_name
+                    learned_ids.add(migration_id)
+            if assignment_name is not None:
+                assignment_ids.setdefault(assignment_name, assignment['id'])
+        print(f"Course ID: {course['id']}, survey assignments matched by: {matched_by}")
+        entry['courses'][str(course['id'])] = assignment_ids
+
+    if prefix_pattern is not None and prefix is None:
+        print(f"Blueprint {blueprint_course}: no synced copy carries a migration_id; "
+              f"survey assignments were matched by name")
+
+    return entry['courses']
+
+
+def get_students_with_assignment(course_id, assignment_name, score, days, assignment_id=None):
     """
     Get a list of students who meet the specified assignment criteria in a given course.
 
@@ -86,6 +288,8 @@ def get_students_with_assignment(course_id, assignment_name, score, days):
         score (int): The target score of the assignment to filter students by.
         days (int): The number of days in the past to consider when filtering 
         by assignment submission date.
+        assignment_id (int): The ID of the assignment, if already known from the
+        assignment index. When omitted, the course's assignments are searched by name.
 
     Returns:
         list: A list of dictionaries containing student information who 
@@ -98,25 +302,23 @@ def get_students_with_assignment(course_id, assignment_name, score, days):
     response = requests.get(url, headers=headers, params=params, timeout=10)
     students = response.json()
 
-    url = f'{COURSEURL}/api/v1/courses/{course_id}/assignments'
-    # Add this line to retrieve the first 200 assignments
-    params = {'per_page': 200}
-    response = requests.get(url, headers=headers, params=params, timeout=10)
-    assignments = response.json()
+    if assignment_id is None:
+        assignments = get_course_assignments(course_id)
 
-    # Print all assignments to inspect the results
-    # print(f"Course ID: {course_id}, All Assignments:")
-    # for a in assignments:
-    # print(f"  - {a['name']} (ID: {a['id']})")
+        # Print all assignments to inspect the results
+        # print(f"Course ID: {course_id}, All Assignments:")
+        # for a in assignments:
+        #    print(f"  - {a['name']} (ID: {a['id']})")
 
-    target_assignment = next(
-        (a for a in assignments if a['name'] == assignment_name), None)
+        target_assignment = next(
+            (a for a in assignments if a['name'] == assignment_name), None)
 
-    if not target_assignment:
-        # print(f"Course ID: {course_id}, '{assignment_name}' not found")
-        return []
+        if not target_assignment:
+            # print(f"Course ID: {course_id}, '{assignment_name}' not found")
+            return []
 
-    target_assignment_id = target_assignment['id']
+        assignment_id = target_assignment['id']
+    target_assignment_id = assignment_id
     # print(f"Course ID: {course_id}, Assign. ID for '{assignment_name}': {target_assignment_id}")
 
     since_date = (datetime.datetime.now() -
@@ -295,7 +497,8 @@ def main():
 
     This function:
         1. Authenticates the user with the Google API and refreshes the access token if necessary.
-        2. Loops through blueprint courses and their associated courses.
+        2. Loops through blueprint courses and their associated courses, using the
+        assignment index to find each course's survey assignment without searching for it.
         3. Retrieves students who completed a specific assignment with a specified score 
         within a given number of days.
         4. Updates the instructor name for each student based on the phase of the course.
@@ -318,16 +521,23 @@ def main():
         with open('token.json', 'w', encoding='utf-8') as token:
             token.write(creds.to_json())
     all_students = []
+    assignment_index = load_assignment_index()
     for blueprint_course in BLUEPRINT_COURSES:
         # print(f"Processing blueprint course: {blueprint_course}")
         associated_courses = get_associated_courses(blueprint_course)
+        course_assignment_ids = resolve_survey_assignment_ids(
+            blueprint_course, associated_courses, assignment_index)
+        save_assignment_index(assignment_index)
         for course in associated_courses:
             # print(f"Processing course ID: {course['id']}")
+            assignment_ids = course_assignment_ids[str(course['id'])]
             for phase_name, instructor_mapping in PHASE_INSTRUCTOR_MAPPING.items():
+                if phase_name not in assignment_ids:
+                    continue
                 new_instructor_name = instructor_mapping['new_instructor']
                 old_instructor_name = instructor_mapping['old_instructor']
                 students = get_students_with_assignment(
-                    course['id'], phase_name, 1, 7)
+                    course['id'], phase_name, 1, 7, assignment_ids[phase_name])
                 for student in students:
                     student["new_instructor_name"] = new_instructor_name
                     student["old_instructor_name"] = old_instructor_name
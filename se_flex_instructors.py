@@ -4,7 +4,24 @@ the new instructors to ops based on assignment completion status in Canvas.
 Remove the load_dotenv lines 12 and 15 if using local variables, or pulling from the environment.
 """
 import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+import pstats
+import hashlib
+import argparse
+import cProfile
 import datetime
+import threading
+import contextlib
+from urllib.parse import urlparse
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -45,6 +62,126 @@ COURSE_INSTRUCTOR_MAPPING = {
     5154: 'Benjamin Aschenbrenner',
     5162: 'Benjamin Aschenbrenner'
 }
+PROGRESS_JOURNAL_FILE = 'progress_journal.jsonl'
+ASSIGNMENT_INDEX_FILE = 'se_assignment_index.json'
+ROSTER_SNAPSHOT_FILE = 'roster_snapshot.db'
+# Rosters younger than this are served from the snapshot without asking Canvas, e.g.
+# when an interrupted run is resumed. A weekly run always refreshes every roster.
+ROSTER_MAX_AGE_HOURS = 12
+# User IDs per request when fetching contact details of changed enrollments
+ROSTER_USER_BATCH = 50
+# Surveys a non-blueprint course found by the 'Phase N' search is checked for:
+# Phase N and Phase N - 1. Blueprint courses are checked for every survey they have.
+SURVEY_PHASE_OFFSETS = (0, 1)
+# Roster size assumed for a course with no total_students and no roster snapshot
+DEFAULT_COURSE_SIZE = 25
+# Low-memory mode moves the dedup keys to disk once this many sheet rows are held
+DEDUP_SPILL_THRESHOLD = 100000
+# Rows read per request from the sheet in low-memory mode
+SHEET_READ_CHUNK = 5000
+# Spans recorded by trace_span() while --trace is on, otherwise None
+TRACE_EVENTS = None
+TRACE_START = time.perf_counter()
+
+
+@contextlib.contextmanager
+def trace_span(name, category='run', **args):
+    """
+    Record the enclosed block as a Chrome Trace Event complete span.
+
+    Spans are only recorded once start_trace() has been called; otherwise this is a no-op.
+
+    Args:
+        name (str): The span name shown in the timeline.
+        category (str): The trace category, e.g. 'canvas', 'sheets' or 'run'.
+        **args: Extra values shown with the span, such as the course ID.
+
+    Yields:
+        dict: The span's args, which the block may add to (e.g. a response status).
+    """
+    if TRACE_EVENTS is None:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        TRACE_EVENTS.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - TRACE_START) * 1e6,
+            'dur': (time.perf_counter() - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        })
+
+
+def start_trace():
+    """
+    Start recording spans for trace_span().
+
+    Returns:
+        None
+    """
+    global TRACE_EVENTS, TRACE_START  # pylint: disable=global-statement
+    TRACE_EVENTS = []
+    TRACE_START = time.perf_counter()
+
+
+def write_trace(path):
+    """
+    Write the recorded spans as a Chrome Trace Event / Perfetto JSON file.
+
+    The file can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+    Args:
+        path (str): The file to write the trace to.
+
+    Returns:
+        None
+    """
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'traceEvents': TRACE_EVENTS or [], 'displayTimeUnit': 'ms'}, file)
+    print(f"Trace with {len(TRACE_EVENTS or [])} spans written to {path}")
+
+
+def traced_get(url, **kwargs):
+    """
+    Send a GET request to the Canvas API inside a 'canvas' trace span.
+
+    Args:
+        url (str): The request URL.
+        **kwargs: Passed through to requests.get().
+
+    Returns:
+        requests.Response: The response.
+    """
+    with trace_span(f'GET {urlparse(url).path}', 'canvas') as span:
+        response = requests.get(url, **kwargs)
+        span['status'] = response.status_code
+    return response
+
+
+def iter_canvas_pages(url, headers, params):
+    """
+    Stream the items of a paginated Canvas API list, one page in memory at a time.
+
+    Args:
+        url (str): The URL of the first page.
+        headers (dict): The request headers.
+        params (dict): The query parameters of the first page; later pages take
+        theirs from the 'next' link.
+
+    Yields:
+        dict: Each item of each page as a JSON object.
+    """
+    while url:
+        response = traced_get(url, headers=headers, params=params, timeout=10)
+        yield from response.json()
+        url = response.links.get('next', {}).get('url')
+        params = None
 
 
 def get_sheet_id_by_name(service, spreadsheet_id, sheet_name):
@@ -59,8 +196,9 @@ def get_sheet_id_by_name(service, spreadsheet_id, sheet_name):
     Returns:
         int: The sheet ID of the specified sheet name, or None if the sheet is not found.
     """
-    sheets_metadata = service.spreadsheets().get(
-        spreadsheetId=spreadsheet_id).execute()
+    with trace_span('spreadsheets.get', 'sheets'):
+        sheets_metadata = service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id).execute()
     sheets = sheets_metadata.get('sheets', '')
 
     sheet_id = None
@@ -89,17 +227,19 @@ def get_associated_courses(course_id):
     headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
     # Add this line to retrieve the first 200 courses
     params = {'per_page': 200}
-    response = requests.get(url, headers=headers, params=params, timeout=10)
+    response = traced_get(url, headers=headers, params=params, timeout=10)
     return response.json()
 
 
 def get_courses_without_blueprint():
     """
-    Retrieves a list of course IDs that are not associated with a 
+    Retrieves the courses that are not associated with a 
     Blueprint course from the Canvas API.
 
     Returns:
-        list: A list of course IDs that are not associated with a Blueprint course.
+        list: A list of courses as JSON objects that are not associated with a Blueprint
+        course, each listed once. Each course also carries the 'search_phases' it was
+        found with.
     """
     url = f'{COURSEURL}/api/v1/accounts/667/courses'
     headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
@@ -109,26 +249,508 @@ def get_courses_without_blueprint():
         'published': True,
         'completed': False,
         'blueprint_associated': False,
+        'include[]': 'total_students',
         'per_page': 100
     }
-    course_ids = []
+    courses = {}
     for phase in range(2, 6):
         search_term = f'Phase {phase}'
         params['search_term'] = search_term
-        response = requests.get(url, headers=headers,
-                                params=params, timeout=10)
+        response = traced_get(url, headers=headers,
+                              params=params, timeout=10)
         if response.status_code == 200:
             results = response.json()
             for result in results:
-                course_ids.append(result['id'])
+                course = courses.setdefault(result['id'], result)
+                course.setdefault('search_phases', []).append(phase)
         else:
             response.raise_for_status()
-    return course_ids
+    return list(courses.values())
+
+
+def get_course_assignments(course_id):
+    """
+    Retrieves the survey assignments of a course from the Canvas API.
+
+    Parameters:
+    course_id (int): The ID of the course for which to fetch assignments.
+
+    Returns:
+    list: A list of assignments as JSON objects.
+    """
+    url = (
+        f'{COURSEURL}/api/v1/courses/{course_id}/'
+        f'assignments?search_term=%5BFlex%5D%20Student%20Survey%20for%20Phase'
+    )
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    # Add this line to retrieve the first 200 assignments
+    params = {'per_page': 200}
+    response = traced_get(url, headers=headers, params=params, timeout=10)
+    return response.json()
+
+
+def get_blueprint_sync_marker(course_id):
+    """
+    Retrieves the ID of the most recent sync of a Blueprint course from the Canvas API.
+
+    Parameters:
+    course_id (int): The ID of the Blueprint course.
+
+    Returns:
+    int: The ID of the latest blueprint migration, or None if it was never synced.
+    """
+    url = f'{COURSEURL}/api/v1/courses/{course_id}/blueprint_templates/default/migrations'
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    params = {'per_page': 100}
+    response = traced_get(url, headers=headers, params=params, timeout=10)
+    migrations = response.json()
+    return max((migration['id'] for migration in migrations), default=None)
+
+
+def get_blueprint_survey_assignments(course_id):
+    """
+    Retrieves the blueprint template ID and the survey assignments of a Blueprint course.
+
+    Parameters:
+    course_id (int): The ID of the Blueprint course.
+
+    Returns:
+    int: The ID of the blueprint template.
+    dict: The survey assignment names keyed by their assignment ID.
+    """
+    url = f'{COURSEURL}/api/v1/courses/{course_id}/blueprint_templates/default'
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    response = traced_get(url, headers=headers, timeout=10)
+    template_id = response.json()['id']
+
+    survey_assignments = {
+        assignment['id']: assignment['name'] for assignment in get_course_assignments(course_id)
+        if assignment['name'] in PHASE_INSTRUCTOR_MAPPING
+    }
+    return template_id, survey_assignments
+
+
+def compute_migration_ids(prefix, shard_id, survey_assignments):
+    """
+    Compute the migration_ids that synced copies of the blueprint's survey assignments carry.
+
+    Canvas tags a synced copy with 'mastercourse_<shard id>_<template id>_' followed by
+    the MD5 of the original's global asset string, 'assignment_<global id>'. The API
+    returns local IDs, and the global ID is shard id * 10**13 + local ID on a sharded
+    instance, so both candidates are hashed.
+
+    Args:
+        prefix (str): The 'mastercourse_<shard id>_<template id>_' prefix of a synced copy.
+        shard_id (int): The shard ID taken from that prefix.
+        survey_assignments (dict): The survey assignment names keyed by blueprint
+        assignment ID, as returned by get_blueprint_survey_assignments().
+
+    Returns:
+        dict: The survey assignment names keyed by their candidate migration_ids.
+    """
+    migration_ids = {}
+    for assignment_id, assignment_name in survey_assignments.items():
+        for asset_id in (assignment_id, shard_id * 10 ** 13 + assignment_id):
+            asset_hash = hashlib.md5(f'assignment_{asset_id}'.encode('utf-8')).hexdigest()
+            migration_ids[prefix + asset_hash] = assignment_name
+    return migration_ids
+
+
+def load_assignment_index():
+    """
+    Load the blueprint-derived assignment ID index from 'se_assignment_index.json'.
+
+    An unreadable index (e.g. left half-written by a crash) is discarded and rebuilt.
+
+    Returns:
+        dict: For each blueprint course ID (as a string), the 'sync_marker' the entry
+        was built against and the survey assignment IDs of its associated 'courses'.
+    """
+    if not os.path.exists(ASSIGNMENT_INDEX_FILE):
+        return {}
+
+    with open(ASSIGNMENT_INDEX_FILE, 'r', encoding='utf-8') as file:
+        try:
+            return json.load(file)
+        except json.JSONDecodeError:
+            print(f"Rebuilding unreadable assignment index '{ASSIGNMENT_INDEX_FILE}'")
+            return {}
+
+
+def save_assignment_index(index):
+    """
+    Save the assignment ID index to 'se_assignment_index.json'.
+
+    The index is written to a temporary file first and then moved into place,
+    so a crash mid-write leaves the previous index intact.
+
+    Args:
+        index (dict): The index returned by load_assignment_index().
+
+    Returns:
+        None
+    """
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(ASSIGNMENT_INDEX_FILE)), suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+        json.dump(index, file)
+    os.replace(temp_path, ASSIGNMENT_INDEX_FILE)
+
+
+def resolve_survey_assignment_ids(blueprint_course, associated_courses, index):
+    """
+    Resolve the survey assignment IDs of every course associated with a Blueprint course.
+
+    The blueprint entry of the index is rebuilt whenever the blueprint has been synced
+    since it was recorded. Courses already in the entry cost no API calls; the others
+    have their assignment list fetched once and are matched to the blueprint's survey
+    assignments by migration_id. The migration_id prefix is taken from the first synced
+    copy seen, and the expected migration_ids are computed from it. When none of them
+    matches, the assignment is matched by name and its real migration_id is used for
+    later courses. Each course logs which path matched.
+
+    Args:
+        blueprint_course (int): The ID of the Blueprint course.
+        associated_courses (list): The associated courses returned by get_associated_courses().
+        index (dict): The index returned by load_assignment_index(); updated in place.
+
+    Returns:
+        dict: For each associated course ID (as a string), the survey assignment IDs
+        keyed by assignment name. Surveys missing from a course are left out.
+    """
+    sync_marker = get_blueprint_sync_marker(blueprint_course)
+    entry = index.get(str(blueprint_course))
+    if entry is None or entry['sync_marker'] != sync_marker:
+        entry = {'sync_marker': sync_marker, 'courses': {}}
+        index[str(blueprint_course)] = entry
+
+    prefix_pattern = None
+    prefix = None
+    migration_ids = {}
+    learned_ids = set()
+    for course in associated_courses:
+        if str(course['id']) in entry['courses']:
+            continue
+        if prefix_pattern is None:
+            template_id, survey_assignments = get_blueprint_survey_assignments(blueprint_course)
+            prefix_pattern = re.compile(rf'^(mastercourse_(\d+)_{template_id}_)[0-9a-f]{{32}}$')
+        assignment_ids = {}
+        matched_by = {}
+        for assignment in get_course_assignments(course['id']):
+            migration_id = assignment.get('migration_id') or ''
+            prefix_match = prefix_pattern.match(migration_id)
+            if prefix is None and prefix_match:
+                # The shard and template part of the prefix is the same for every copy
+                prefix = prefix_match.group(1)
+                migration_ids.update(compute_migration_ids(
+                    prefix, int(prefix_match.group(2)), survey_assignments))
+            assignment_name = migration_ids.get(migration_id)
+            if assignment_name is not None:
+                matched_by[assignment_name] = (
+                    'learned migration_id' if migration_id in learned_ids else 'migration_id')
+            elif assignment['name'] in PHASE_INSTRUCTOR_MAPPING:
+                assignment_name = assignment['name']
+                matched_by[assignment_name] = 'name'
+                if prefix_match:
+                    # Every synced copy of a blueprint assignment carries the same
+                    # migration_id, so later courses can match on it even if renamed
+                    migration_ids[migration_id] = assignment_name
+                    learned_ids.add(migration_id)
+            if assignment_name is not None:
+                assignment_ids.setdefault(assignment_name, assignment['id'])
+        print(f"Course ID: {course['id']}, survey assignments matched by: {matched_by}")
+        entry['courses'][str(course['id'])] = assignment_ids
+
+    if prefix_pattern is not None and prefix is None:
+        print(f"Blueprint {blueprint_course}: no synced copy carries a migration_id; "
+              f"survey assignments were matched by name")
+
+    return entry['courses']
+
+
+def open_roster_snapshot():
+    """
+    Open the local roster snapshot store, creating its tables if needed.
+
+    The 'snapshots' table records when each course was last refreshed and the newest
+    enrollment updated_at seen; the 'roster' table holds its active students, and
+    'roster_pending' the active students whose details could not be fetched yet.
+
+    Returns:
+        sqlite3.Connection: A connection to 'roster_snapshot.db'.
+    """
+    conn = sqlite3.connect(ROSTER_SNAPSHOT_FILE)
+    conn.execute('CREATE TABLE IF NOT EXISTS snapshots (course_id INTEGER PRIMARY KEY, '
+                 'refreshed_at TEXT, watermark TEXT)')
+    conn.execute('CREATE TABLE IF NOT EXISTS roster (course_id INTEGER, user_id INTEGER, '
+                 'name TEXT, sortable_name TEXT, email TEXT, sis_user_id TEXT, '
+                 'updated_at TEXT, PRIMARY KEY (course_id, user_id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS roster_pending (course_id INTEGER, '
+                 'user_id INTEGER, PRIMARY KEY (course_id, user_id))')
+    return conn
+
+
+def iter_course_users(course_id, user_ids):
+    """
+    Retrieves the names, SIS IDs and email addresses of some students of a course
+    from the Canvas API, one batch of ROSTER_USER_BATCH users at a time.
+
+    Parameters:
+    course_id (int): The ID of the course.
+    user_ids (list): The IDs of the users to fetch.
+
+    Yields:
+    dict: Each user as a JSON object.
+    """
+    url = f'{COURSEURL}/api/v1/courses/{course_id}/users'
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    for start in range(0, len(user_ids), ROSTER_USER_BATCH):
+        params = {
+            'enrollment_type[]': 'student',
+            'include[]': 'email',
+            'user_ids[]': user_ids[start:start + ROSTER_USER_BATCH],
+            'per_page': 100
+        }
+        yield from iter_canvas_pages(url, headers, params)
+
+
+def store_roster_user(conn, course_id, user, updated_at):
+    """
+    Write a student's details from the /users endpoint to the roster snapshot.
+
+    Args:
+        conn (sqlite3.Connection): The connection returned by open_roster_snapshot().
+        course_id (int): The ID of the course.
+        user (dict): The user as returned by iter_course_users().
+        updated_at (str): The updated_at of the student's enrollment.
+
+    Returns:
+        None
+    """
+    conn.execute('INSERT OR REPLACE INTO roster VALUES (?, ?, ?, ?, ?, ?, ?)', (
+        course_id, user['id'], user['name'], user['sortable_name'],
+        user.get('email', 'No email'), user.get('sis_user_id'), updated_at))
+
+
+def refresh_roster(conn, course_id, watermark):
+    """
+    Bring the snapshot of a course's roster up to date with its active student enrollments.
+
+    The active enrollment list is still paged through in full, so the number of requests
+    grows with enrollment as before. The active IDs are staged in a temporary table, so
+    memory stays bounded. Only enrollments updated after the watermark, and students
+    still pending from an earlier refresh, have their contact details fetched from the
+    users endpoint. Each batch is written as it arrives. Students no longer actively
+    enrolled are removed. The writes and user lookups therefore track churn.
+
+    Args:
+        conn (sqlite3.Connection): The connection returned by open_roster_snapshot().
+        course_id (int): The ID of the course to refresh.
+        watermark (str): The newest enrollment updated_at of the previous snapshot,
+        or None if the course has never been snapshotted.
+
+    Returns:
+        None
+    """
+    url = f'{COURSEURL}/api/v1/courses/{course_id}/enrollments'
+    headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
+    params = {'type[]': 'StudentEnrollment', 'state[]': 'active', 'per_page': 100}
+
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS active '
+                 '(user_id INTEGER PRIMARY KEY, updated_at TEXT)')
+    conn.execute('DELETE FROM active')
+    for enrollment in iter_canvas_pages(url, headers, params):
+        # A student with several sections keeps the newest enrollment updated_at
+        conn.execute('INSERT INTO active VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE '
+                     'SET updated_at = max(updated_at, excluded.updated_at)',
+                     (enrollment['user_id'], enrollment.get('updated_at') or ''))
+
+    changed_query = ('SELECT user_id, updated_at FROM active WHERE updated_at > ? '
+                     'OR user_id IN (SELECT user_id FROM roster_pending WHERE course_id = ?) '
+                     'ORDER BY user_id LIMIT ? OFFSET ?')
+    changed = 0
+    while True:
+        batch = dict(conn.execute(changed_query, (
+            watermark or '', course_id, ROSTER_USER_BATCH, changed)).fetchall())
+        if not batch:
+            break
+        changed += len(batch)
+        # The enrollment's nested user has no email, so take contact fields from /users
+        for user in iter_course_users(course_id, list(batch)):
+            if user['id'] in batch:
+                store_roster_user(conn, course_id, user, batch.pop(user['id']))
+        for user_id in batch:
+            print(f"Course ID: {course_id}, user {user_id} not returned by /users; "
+                  f"retried on the next refresh")
+        conn.executemany('INSERT OR IGNORE INTO roster_pending VALUES (?, ?)',
+                         [(course_id, user_id) for user_id in batch])
+
+    conn.execute('DELETE FROM roster_pending WHERE course_id = ? AND user_id IN '
+                 '(SELECT user_id FROM roster WHERE course_id = ?)', (course_id, course_id))
+    removed = conn.execute('DELETE FROM roster WHERE course_id = ? AND user_id NOT IN '
+                           '(SELECT user_id FROM active)', (course_id,)).rowcount
+    conn.execute('DELETE FROM roster_pending WHERE course_id = ? AND user_id NOT IN '
+                 '(SELECT user_id FROM active)', (course_id,))
+    # Pending students are retried regardless of the watermark, so it can move past them
+    new_watermark = conn.execute('SELECT max(updated_at) FROM active').fetchone()[0]
+    conn.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)', (
+        course_id, datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        max(new_watermark or '', watermark or '') or None))
+    conn.commit()
+    print(f"Course ID: {course_id}, roster refreshed: {changed} changed, {removed} removed")
+
+
+def iter_roster(conn, course_id):
+    """
+    Stream the students of a course from the roster snapshot, closing the connection
+    once they have all been read.
+
+    Args:
+        conn (sqlite3.Connection): The connection returned by open_roster_snapshot().
+        course_id (int): The ID of the course.
+
+    Yields:
+        dict: Each student with id, name, sortable_name, email and sis_user_id.
+    """
+    try:
+        cursor = conn.execute('SELECT user_id, name, sortable_name, email, sis_user_id '
+                              'FROM roster WHERE course_id = ?', (course_id,))
+        for row in cursor:
+            yield {
+                'id': row[0],
+                'name': row[1],
+                'sortable_name': row[2],
+                'email': row[3],
+                'sis_user_id': row[4]
+            }
+    finally:
+        conn.close()
 
 
-def get_students_with_assignment(course_id, assignment_name, score, days):
+def get_roster_size(course_id):
+    """
+    Get the number of active students in the roster snapshot of a course, without
+    refreshing it.
+
+    Args:
+        course_id (int): The ID of the course.
+
+    Returns:
+        int: The number of students, or None if the course has no snapshot yet.
+    """
+    if not os.path.exists(ROSTER_SNAPSHOT_FILE):
+        return None
+    conn = open_roster_snapshot()
+    try:
+        if conn.execute('SELECT 1 FROM snapshots WHERE course_id = ?',
+                        (course_id,)).fetchone() is None:
+            return None
+        return conn.execute('SELECT COUNT(*) FROM roster WHERE course_id = ?',
+                            (course_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def get_roster(course_id, low_memory=False):
+    """
+    Get the active students of a course from the local roster snapshot,
+    refreshing the snapshot first if it is missing or older than ROSTER_MAX_AGE_HOURS.
+
+    Args:
+        course_id (int): The ID of the course.
+        low_memory (bool): Stream the students from the snapshot instead of returning a list.
+
+    Returns:
+        list: The students as dictionaries with id, name, sortable_name, email
+        and sis_user_id, or an iterator over them in low-memory mode.
+    """
+    conn = open_roster_snapshot()
+    snapshot = conn.execute('SELECT refreshed_at, watermark FROM snapshots WHERE course_id = ?',
+                            (course_id,)).fetchone()
+    stale_before = (datetime.datetime.now() - datetime.timedelta(
+        hours=ROSTER_MAX_AGE_HOURS)).strftime('%Y-%m-%dT%H:%M:%S')
+    if snapshot is None or snapshot[0] < stale_before:
+        with trace_span('roster refresh', 'canvas', course_id=course_id):
+            refresh_roster(conn, course_id, snapshot[1] if snapshot else None)
+
+    students = iter_roster(conn, course_id)
+    return students if low_memory else list(students)
+
+
+def refresh_contact_fields(course_id, students):
+    """
+    Refresh the name, email and SIS ID of qualified students from the /users endpoint.
+
+    Snapshot rows only change when an enrollment does, so a renamed student or a new
+    email address would otherwise never reach the sheet. The fresh values are also
+    written back to the roster snapshot.
+
+    Args:
+        course_id (int): The ID of the course.
+        students (list): The qualified students, updated in place.
+
+    Returns:
+        None
+    """
+    if not students:
+        return
+    students_by_id = {student['id']: student for student in students}
+    conn = open_roster_snapshot()
+    try:
+        for user in iter_course_users(course_id, list(students_by_id)):
+            student = students_by_id.get(user['id'])
+            if student is None:
+                continue
+            student['name'] = user['name']
+            student['sortable_name'] = user['sortable_name']
+            student['email'] = user.get('email', 'No email')
+            student['sis_user_id'] = user.get('sis_user_id')
+            conn.execute('UPDATE roster SET name = ?, sortable_name = ?, email = ?, '
+                         'sis_user_id = ? WHERE course_id = ? AND user_id = ?', (
+                             student['name'], student['sortable_name'], student['email'],
+                             student['sis_user_id'], course_id, user['id']))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class StudentRecord:
+    """
+    A qualified student, stored with __slots__ instead of a dict in low-memory mode.
+
+    Supports the same item access as the student dictionaries, so dict(record)
+    and record['sis_user_id'] work alike for both.
+    """
+    __slots__ = ('id', 'name', 'sortable_name', 'email', 'sis_user_id',
+                 'assignment_name', 'new_instructor_name')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+    def keys(self):
+        """Return the field names, as dict.keys() would."""
+        return self.__slots__
+
+    def get(self, field, default=None):
+        """Return a field, or default if it is not set."""
+        return getattr(self, field) if field in self.__slots__ else default
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def get_students_with_assignment(course_id, assignment_name, score, days, assignment_id=None,
+                                 low_memory=False):
     """
     Get a list of students who meet the specified assignment criteria in a given course.
+    Only actively enrolled students, as served by get_roster(), are checked.
 
     Args:
         course_id (int): The ID of the course to search for students.
@@ -136,42 +758,38 @@ def get_students_with_assignment(course_id, assignment_name, score, days):
         score (int): The target score of the assignment to filter students by.
         days (int): The number of days in the past to consider when filtering 
         by assignment submission date.
+        assignment_id (int): The ID of the assignment, if already known from the
+        assignment index. When omitted, the course's assignments are searched by name.
+        low_memory (bool): Stream the roster from the snapshot, skip the unused submission
+        history, and return StudentRecord objects instead of dictionaries.
 
     Returns:
         list: A list of dictionaries containing student information who 
         meet the specified criteria. Each dictionary includes 
         student id, name, sortable_name, email, sis_user_id, and assignment_name.
     """
-    url = f'{COURSEURL}/api/v1/courses/{course_id}/users'
-    params = {'enrollment_type[]': 'student', 'per_page': 100}
     headers = {'Authorization': f'Bearer {CANVAS_API_KEY}'}
-    response = requests.get(url, headers=headers, params=params, timeout=10)
-    students = response.json()
 
-    url = (
-        f'{COURSEURL}/api/v1/courses/{course_id}/'
-        f'assignments?search_term=%5BFlex%5D%20Student%20Survey%20for%20Phase'
-    )
-    # Add this line to retrieve the first 200 assignments
-    params = {'per_page': 200}
-    response = requests.get(url, headers=headers, params=params, timeout=10)
-    assignments = response.json()
+    if assignment_id is None:
+        assignments = get_course_assignments(course_id)
 
-    # Print all assignments to inspect the results
-    # print(f"Course ID: {course_id}, All Assignments:")
-    # for a in assignments:
-    #    print(f"  - {a['name']} (ID: {a['id']})")
+        # Print all assignments to inspect the results
+        # print(f"Course ID: {course_id}, All Assignments:")
+        # for a in assignments:
+        #    print(f"  - {a['name']} (ID: {a['id']})")
 
-    target_assignment = next(
-        (a for a in assignments if a['name'] == assignment_name), None)
+        target_assignment = next(
+            (a for a in assignments if a['name'] == assignment_name), None)
 
-    if not target_assignment:
-        # print(f"Course ID: {course_id}, '{assignment_name}' not found")
-        return []
+        if not target_assignment:
+            # print(f"Course ID: {course_id}, '{assignment_name}' not found")
+            return []
 
-    target_assignment_id = target_assignment['id']
+        assignment_id = target_assignment['id']
+    target_assignment_id = assignment_id
     # print(f"Course ID: {course_id}, Assign. ID for '{assignment_name}': {target_assignment_id}")
 
+    students = get_roster(course_id, low_memory)
     since_date = (datetime.datetime.now() -
                   datetime.timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
 
@@ -182,9 +800,9 @@ def get_students_with_assignment(course_id, assignment_name, score, days):
             f'{target_assignment_id}/submissions/{student["id"]}'
         )
 
-        params = {'include': ['submission_history']}
-        response = requests.get(url, headers=headers,
-                                params=params, timeout=10)
+        params = {} if low_memory else {'include': ['submission_history']}
+        response = traced_get(url, headers=headers,
+                              params=params, timeout=10)
         try:
             submission = response.json()
             if 'errors' in submission:
@@ -197,26 +815,170 @@ def get_students_with_assignment(course_id, assignment_name, score, days):
                 phase_name = assignment_name
                 new_instructor_name = PHASE_INSTRUCTOR_MAPPING[phase_name].get(
                     'new_instructor', 'Unknown Instructor')
-                qualified_students.append({
-                    'id': student['id'],
-                    'name': student_name,
-                    'sortable_name': student['sortable_name'],
-                    'email': student.get('email', 'No email'),
-                    'sis_user_id': student['sis_user_id'],
-                    'assignment_name': assignment_name,
-                    'new_instructor_name': new_instructor_name
-                })
-                print(qualified_students)
+                record = StudentRecord if low_memory else dict
+                qualified_students.append(record(
+                    id=student['id'],
+                    name=student_name,
+                    sortable_name=student['sortable_name'],
+                    email=student.get('email', 'No email'),
+                    sis_user_id=student['sis_user_id'],
+                    assignment_name=assignment_name,
+                    new_instructor_name=new_instructor_name
+                ))
+                print(qualified_students[-1] if low_memory else qualified_students)
         except KeyError as e:
             print(f"KeyError: {e}")
             print(f"Current student: {student}")
             print(f"Current submission: {submission}")
 
+    refresh_contact_fields(course_id, qualified_students)
     return qualified_students
 
 
 
-def append_to_google_sheet(data, creds):
+class SheetKey:
+    """
+    The (sis_user_id, assignment_name) pair that identifies a row already in the sheet.
+    """
+    __slots__ = ('sis_user_id', 'assignment_name')
+
+    def __init__(self, sis_user_id, assignment_name):
+        self.sis_user_id = sis_user_id
+        self.assignment_name = assignment_name
+
+    def __eq__(self, other):
+        return (self.sis_user_id, self.assignment_name) == (
+            other.sis_user_id, other.assignment_name)
+
+    def __hash__(self):
+        return hash((self.sis_user_id, self.assignment_name))
+
+
+class DedupKeySet:
+    """
+    A set of SheetKey objects that moves to a temporary SQLite file once it holds
+    more than spill_threshold keys, so memory stays bounded for very large sheets.
+    """
+
+    def __init__(self, spill_threshold=None):
+        """
+        Args:
+            spill_threshold (int): The number of keys to keep in memory before spilling
+            to disk, or None to always keep them in memory.
+        """
+        self.spill_threshold = spill_threshold
+        self._keys = set()
+        self._db = None
+        self._db_path = None
+
+    def add(self, key):
+        """Add a SheetKey to the set."""
+        if self._db is not None:
+            self._db.execute('INSERT OR IGNORE INTO keys VALUES (?, ?)',
+                             (key.sis_user_id, key.assignment_name))
+            return
+        self._keys.add(key)
+        if self.spill_threshold is not None and len(self._keys) > self.spill_threshold:
+            self._spill()
+
+    def __contains__(self, key):
+        if self._db is None:
+            return key in self._keys
+        return self._db.execute(
+            'SELECT 1 FROM keys WHERE sis_user_id = ? AND assignment_name = ?',
+            (key.sis_user_id, key.assignment_name)).fetchone() is not None
+
+    def __len__(self):
+        if self._db is None:
+            return len(self._keys)
+        return self._db.execute('SELECT COUNT(*) FROM keys').fetchone()[0]
+
+    def _spill(self):
+        file_descriptor, self._db_path = tempfile.mkstemp(suffix='.db')
+        os.close(file_descriptor)
+        self._db = sqlite3.connect(self._db_path)
+        self._db.execute('CREATE TABLE keys (sis_user_id TEXT, assignment_name TEXT, '
+                         'PRIMARY KEY (sis_user_id, assignment_name)) WITHOUT ROWID')
+        self._db.executemany('INSERT OR IGNORE INTO keys VALUES (?, ?)',
+                             ((key.sis_user_id, key.assignment_name) for key in self._keys))
+        self._keys = None
+        print(f"Dedup keys spilled to {self._db_path}")
+
+    def close(self):
+        """Remove the temporary SQLite file, if the set was spilled to disk."""
+        if self._db is not None:
+            self._db.close()
+            os.remove(self._db_path)
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_sheet_row_count(service, spreadsheet_id, sheet_name):
+    """
+    Get the number of rows in the grid of a Google Sheet tab, including blank ones.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The Google Sheets API service instance.
+        spreadsheet_id (str): The ID of the Google Sheet.
+        sheet_name (str): The name of the sheet within the Google Sheet.
+
+    Returns:
+        int: The rowCount of the sheet, or 0 if the sheet is not found.
+    """
+    with trace_span('spreadsheets.get', 'sheets', fields='gridProperties'):
+        sheets_metadata = service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties(title,gridProperties.rowCount)').execute()
+    for sheet in sheets_metadata.get('sheets', []):
+        if sheet['properties']['title'] == sheet_name:
+            return sheet['properties']['gridProperties']['rowCount']
+    return 0
+
+
+def iter_sheet_keys(service, spreadsheet_id, chunk_rows=None):
+    """
+    Stream the SheetKey of every existing row of the sheet tab.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The Google Sheets API service instance.
+        spreadsheet_id (str): The ID of the Google Sheet.
+        chunk_rows (int): The number of rows to read per request, or None to read
+        the whole range in one request. Chunks cover the sheet's full rowCount, since
+        values.get leaves out blank rows at the end of each range.
+
+    Yields:
+        SheetKey: The key of each row that has an assignment name.
+    """
+    start_row = 2
+    row_count = None
+    if chunk_rows is not None:
+        row_count = get_sheet_row_count(service, spreadsheet_id, SHEET_TAB_NAME)
+    while True:
+        # Assuming 'sis_user_id' is in column C and 'assignment_name' is in column F
+        if chunk_rows is None:
+            range_name = f'{SHEET_TAB_NAME}!A2:F'
+        else:
+            range_name = f'{SHEET_TAB_NAME}!A{start_row}:F{start_row + chunk_rows - 1}'
+        # pylint: disable=maybe-no-member
+        with trace_span('values.get', 'sheets', range=range_name):
+            result = service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id, range=range_name).execute()
+        rows = result.get('values', [])
+        for row in rows:
+            if len(row) > 5:
+                yield SheetKey(row[2], row[5])
+        start_row += chunk_rows or 0
+        if chunk_rows is None or start_row > row_count:
+            return
+
+
+def append_to_google_sheet(data, creds, low_memory=False,
+                           spill_threshold=DEDUP_SPILL_THRESHOLD):
     """
     Append non-duplicate student data to a specified Google Sheet, 
     based on student UUID matched with new instructor name.
@@ -224,8 +986,11 @@ def append_to_google_sheet(data, creds):
     Args:
         data (list): A list of dictionaries containing student information to append.
         Each dictionary includes student id, name, sortable_name, email, sis_user_id, 
-        and assignment_name.
+        and assignment_name. Any iterable works, so low-memory runs can stream it.
         creds (google.oauth2.credentials.Credentials): The user's Google API credentials.
+        low_memory (bool): Read the existing sheet in chunks of SHEET_READ_CHUNK rows and
+        spill the duplicate keys to disk once there are more than spill_threshold of them.
+        spill_threshold (int): The number of duplicate keys kept in memory in low-memory mode.
 
     Returns:
         None
@@ -235,63 +1000,47 @@ def append_to_google_sheet(data, creds):
     spreadsheet_id = '1-SrzwExIqVDfrQRu1s-uruRJwatifFQQI6feZu6-das'
     sheet_id = get_sheet_id_by_name(service, spreadsheet_id, SHEET_TAB_NAME)
 
-   # Step 1: Retrieve the existing data from the Google Sheet
-    # Assuming 'sis_user_id' is in column C and 'new_instructor_name' is in column E
-    range_name = f'{SHEET_TAB_NAME}!A2:F'
-    # pylint: disable=maybe-no-member
-    result = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id, range=range_name).execute()
-    existing_data = result.get('values', [])
-
-    # Step 2: Extract the 'sis_user_id', 'new_instructor_name', and 'assignment_name' column data
-    existing_students = [
-        {
-            'sis_user_id': row[2],
-            'assignment_name': row[5]
-        } for row in existing_data if len(row) > 5
-
-    ] if existing_data else []
-    values = []
-
-    # Define current_row before the loop
-    current_row = len(existing_data) + 2
-
-    # Step 3: Check for duplicates between the new data and the existing data
-    for student in data:
-        print(f'Student: {student}')
-        print(f'Existing: {existing_students}')
-        # Check if the student is already in the sheet with the same new instructor name
-        is_duplicate = any(
-            existing_student['sis_user_id'] == student['sis_user_id']
-            and existing_student['assignment_name'] == student['assignment_name']
-            for existing_student in existing_students
-        )
-        print(is_duplicate)
-        if not is_duplicate:
-            row = [
-                datetime.datetime.now().strftime('%Y-%m-%d'),  # Week of
-                student['name'],  # Full name
-                student['sis_user_id'],  # sis_user_id
-                student['email'],  # Email address
-                student['new_instructor_name'],  # new instructor name
-                student['assignment_name'],  # Which phase completed
-                {"userEnteredValue": {
-                    "formulaValue": (
-                        f'=IFERROR(VLOOKUP("{student["new_instructor_name"]}",'
-                        f' \'Instructor Roster\'!A:B, 2, FALSE), "not found")'
-                    )
-                }}
-            ]
-
-            values.append(row)
-            current_row += 1  # only add the increment for the vlookup when appending a row
-
-    if not values:
+    with DedupKeySet(spill_threshold if low_memory else None) as existing_students:
+        # Step 1: Retrieve the 'sis_user_id' and 'assignment_name' of the existing rows
+        for key in iter_sheet_keys(service, spreadsheet_id,
+                                   SHEET_READ_CHUNK if low_memory else None):
+            existing_students.add(key)
+
+        # Step 2: Check for duplicates between the new data and the existing data
+        values_for_update = []
+        with trace_span('dedup', existing=len(existing_students)) as span:
+            span['students'] = 0
+            for student in data:
+                span['students'] += 1
+                print(f'Student: {student}')
+                # Check if the student is already in the sheet for the same phase
+                is_duplicate = SheetKey(
+                    student['sis_user_id'], student['assignment_name']) in existing_students
+                print(is_duplicate)
+                if not is_duplicate:
+                    row = [
+                        datetime.datetime.now().strftime('%Y-%m-%d'),  # Week of
+                        student['name'],  # Full name
+                        student['sis_user_id'],  # sis_user_id
+                        student['email'],  # Email address
+                        student['new_instructor_name'],  # new instructor name
+                        student['assignment_name'],  # Which phase completed
+                        {"userEnteredValue": {
+                            "formulaValue": (
+                                f'=IFERROR(VLOOKUP("{student["new_instructor_name"]}",'
+                                f' \'Instructor Roster\'!A:B, 2, FALSE), "not found")'
+                            )
+                        }}
+                    ]
+                    values_for_update.append({'values': [
+                        {'userEnteredValue': {'stringValue': str(cell)}}
+                        if not isinstance(cell, dict) else cell for cell in row]})
+
+    if not values_for_update:
         print("No new data to add.")
         return
 
-    values_for_update = [{'values': [{'userEnteredValue': {'stringValue': str(
-        cell)}} if not isinstance(cell, dict) else cell for cell in row]} for row in values]
+    row_length = len(values_for_update[0]['values'])
 
     body = {
         'requests': [
@@ -300,7 +1049,7 @@ def append_to_google_sheet(data, creds):
                     'range': {
                         'sheetId': sheet_id,  # set by variable at top of script
                         'startRowIndex': 1,
-                        'endRowIndex': 1 + len(values)
+                        'endRowIndex': 1 + len(values_for_update)
                     },
                     'shiftDimension': 'ROWS'
                 }
@@ -310,10 +1059,10 @@ def append_to_google_sheet(data, creds):
                     'range': {
                         'sheetId': sheet_id,  # set by variable at top of script
                         'startRowIndex': 1,
-                        'endRowIndex': 1 + len(values),
+                        'endRowIndex': 1 + len(values_for_update),
                         'startColumnIndex': 0,
                         # increase end column index by 1 for the Ops Complete Data Validation
-                        'endColumnIndex': 1 + len(values[0]) + 1
+                        'endColumnIndex': 1 + row_length + 1
                     },
                     'rows': values_for_update,
                     'fields': 'userEnteredValue'
@@ -322,13 +1071,13 @@ def append_to_google_sheet(data, creds):
         ]
     }
 
-    # print(values)
-    # Step 4: Add only the non-duplicate data to the Google Sheet
+    # Step 3: Add only the non-duplicate data to the Google Sheet
     # pylint: disable=maybe-no-member
-    result = service.spreadsheets().batchUpdate(
-        spreadsheetId=spreadsheet_id, body=body).execute()
+    with trace_span('batchUpdate', 'sheets', rows=len(values_for_update)):
+        result = service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id, body=body).execute()
 
-    updated_rows = len(values)
+    updated_rows = len(values_for_update)
     print(f'{updated_rows} rows updated.')
 
 
@@ -379,24 +1128,360 @@ def save_counters(phase_2_counter, phase_5_counter):
         file.write(str(phase_2_counter) + '\n')
         file.write(str(phase_5_counter) + '\n')
 
-def main():
+
+def progress_unit_key(course_id, phase_name):
+    """
+    Build the journal key for one (course, phase) unit of work.
+
+    Args:
+        course_id (int): The ID of the course being processed.
+        phase_name (str): The survey assignment name being checked.
+
+    Returns:
+        str: The key under which the unit is recorded in the progress journal.
+    """
+    return f'{course_id}:{phase_name}'
+
+
+def load_progress_journal(run_date, keep_students=True):
+    """
+    Load the progress journal left behind by an interrupted run.
+
+    Each line of 'progress_journal.jsonl' records one finished (course, phase) unit,
+    the run date it was queried on, the qualified students it produced and the
+    instructor rotation counters after it. A partially written last line (e.g. from
+    a crash mid-write) is ignored.
+
+    A journal from another day covers a different submission window, so reusing it
+    would skip students who qualified since. Such a journal is discarded.
+
+    Args:
+        run_date (str): The date of the current run, as 'YYYY-MM-DD'.
+        keep_students (bool): Load each unit's students. When False, units map to None
+        and the students are read back later with iter_journal_students().
+
+    Returns:
+        completed_units (dict): Qualified students keyed by progress_unit_key().
+        counters (tuple): The (phase_2_counter, phase_5_counter) recorded by the last
+        finished unit, or None if the journal is empty or missing.
+    """
+    completed_units = {}
+    counters = None
+    if not os.path.exists(PROGRESS_JOURNAL_FILE):
+        return completed_units, counters
+
+    valid_lines = []
+    skipped = False
+    with open(PROGRESS_JOURNAL_FILE, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping incomplete journal entry: {line.strip()}")
+                skipped = True
+                continue
+            if entry.get('run_date') != run_date:
+                print(f"Discarding progress journal from {entry.get('run_date')}: "
+                      f"it does not cover the submission window of {run_date}")
+                break
+            completed_units[entry['unit']] = entry['students'] if keep_students else None
+            counters = (entry['phase_2_counter'], entry['phase_5_counter'])
+            valid_lines.append(line if line.endswith('\n') else line + '\n')
+        else:
+            if skipped:
+                # Drop the incomplete entry so new entries start on a fresh line
+                with open(PROGRESS_JOURNAL_FILE, 'w', encoding='utf-8') as rewrite:
+                    rewrite.writelines(valid_lines)
+            return completed_units, counters
+
+    clear_progress_journal()
+    return {}, None
+
+
+def record_progress(unit_key, run_date, students, phase_2_counter, phase_5_counter):
+    """
+    Append a finished (course, phase) unit to the progress journal.
+
+    The entry is flushed and fsynced before returning so a crash right after
+    this call cannot lose the unit.
+
+    Args:
+        unit_key (str): The key returned by progress_unit_key().
+        run_date (str): The date of the current run, as 'YYYY-MM-DD'.
+        students (list): The qualified students found for the unit, with
+        new_instructor_name already assigned.
+        phase_2_counter (int): The phase 2 rotation counter after the unit.
+        phase_5_counter (int): The phase 5 rotation counter after the unit.
+
+    Returns:
+        None
+    """
+    entry = {
+        'unit': unit_key,
+        'run_date': run_date,
+        'students': [dict(student) for student in students],
+        'phase_2_counter': phase_2_counter,
+        'phase_5_counter': phase_5_counter
+    }
+    with open(PROGRESS_JOURNAL_FILE, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(entry) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def iter_journal_students():
+    """
+    Stream the qualified students of every unit in the progress journal, so a
+    low-memory run does not have to hold them all in memory.
+
+    Yields:
+        StudentRecord: Each journaled student, with new_instructor_name assigned.
+    """
+    if not os.path.exists(PROGRESS_JOURNAL_FILE):
+        return
+    with open(PROGRESS_JOURNAL_FILE, 'r', encoding='utf-8') as file:
+        for line in file:
+            for student in json.loads(line)['students']:
+                yield StudentRecord(**student)
+
+
+def clear_progress_journal():
+    """
+    Remove the progress journal once a run has written its results and counters.
+
+    Returns:
+        None
+    """
+    if os.path.exists(PROGRESS_JOURNAL_FILE):
+        os.remove(PROGRESS_JOURNAL_FILE)
+
+
+def get_phase_number(name):
+    """
+    Extract the phase number from a course or assignment name.
+
+    Args:
+        name (str): A name such as 'SE Flex Phase 2' or '[Flex] Student Survey for Phase 1'.
+
+    Returns:
+        int: The phase number, or None if the name does not mention a phase.
+    """
+    match = re.search(r'Phase (\d+)', name or '')
+    return int(match.group(1)) if match else None
+
+
+def survey_can_match(course_phases, phase_name):
+    """
+    Check whether a non-blueprint course found by phase searches can hold the given survey.
+
+    Args:
+        course_phases (list): The phases of the searches that found the course.
+        phase_name (str): The survey assignment name.
+
+    Returns:
+        bool: True if any of the phases allows the survey.
+    """
+    survey_phase = get_phase_number(phase_name)
+    return any(course_phase - survey_phase in SURVEY_PHASE_OFFSETS
+               for course_phase in course_phases)
+
+
+def estimate_unit_cost(course, assignment_id):
+    """
+    Estimate the number of Canvas requests a (course, phase) unit will make.
+
+    The roster size comes from the course's total_students if Canvas reported it,
+    otherwise from the roster snapshot.
+
+    Args:
+        course (dict): The course as returned by the Canvas API.
+        assignment_id (int): The survey assignment ID, or None if it must be searched for.
+
+    Returns:
+        cost (int): One roster request, one assignment search if needed, and one
+        submission request per student.
+        known (bool): False if the roster size is unknown and DEFAULT_COURSE_SIZE was used.
+    """
+    students = course.get('total_students')
+    if students is None:
+        students = get_roster_size(course['id'])
+    known = students is not None
+    if not known:
+        students = DEFAULT_COURSE_SIZE
+    return 1 + (1 if assignment_id is None else 0) + students, known
+
+
+def build_work_plan(assignment_index, save_index=True):
+    """
+    Build the list of (course, phase) work units for a run.
+
+    Blueprint courses keep a unit for every survey the assignment index shows they
+    have. Non-blueprint courses keep the surveys that SURVEY_PHASE_OFFSETS allows for
+    any of the phase searches that found them and that their assignment list, fetched
+    once per course here, actually contains. Courses already planned are skipped. The
+    remaining units are ordered cheapest first so the progress journal covers as many
+    units as possible early in the run.
+
+    Args:
+        assignment_index (dict): The index returned by load_assignment_index(); updated
+        in place and, if save_index is set, saved after each blueprint.
+        save_index (bool): Save the assignment index; False for a read-only dry run.
+
+    Returns:
+        units (list): The work units, each a dict with course_id, course_name,
+        phase_name, assignment_id, blueprint_course, cost and cost_known.
+        pruned (list): The dropped units, each a dict with course_id, course_name,
+        phase_name and reason.
+    """
+    units = []
+    pruned = []
+    planned_courses = set()
+
+    def add_unit(course, phase_name, assignment_id, blueprint_course):
+        cost, cost_known = estimate_unit_cost(course, assignment_id)
+        units.append({
+            'course_id': course['id'],
+            'course_name': course.get('name'),
+            'phase_name': phase_name,
+            'assignment_id': assignment_id,
+            'blueprint_course': blueprint_course,
+            'cost': cost,
+            'cost_known': cost_known
+        })
+
+    def prune_unit(course, phase_name, reason):
+        pruned.append({
+            'course_id': course['id'],
+            'course_name': course.get('name'),
+            'phase_name': phase_name,
+            'reason': reason
+        })
+
+    for blueprint_course in BLUEPRINT_COURSES:
+        associated_courses = get_associated_courses(blueprint_course)
+        course_assignment_ids = resolve_survey_assignment_ids(
+            blueprint_course, associated_courses, assignment_index)
+        if save_index:
+            save_assignment_index(assignment_index)
+        for course in associated_courses:
+            if course['id'] in planned_courses:
+                for phase_name in PHASE_INSTRUCTOR_MAPPING:
+                    prune_unit(course, phase_name, 'course already planned')
+                continue
+            planned_courses.add(course['id'])
+            assignment_ids = course_assignment_ids[str(course['id'])]
+            for phase_name in PHASE_INSTRUCTOR_MAPPING:
+                if phase_name not in assignment_ids:
+                    prune_unit(course, phase_name, 'survey not in course')
+                    continue
+                add_unit(course, phase_name, assignment_ids[phase_name], blueprint_course)
+
+    for course in get_courses_without_blueprint():
+        if course['id'] in planned_courses:
+            for phase_name in PHASE_INSTRUCTOR_MAPPING:
+                prune_unit(course, phase_name, 'course already planned')
+            continue
+        planned_courses.add(course['id'])
+        search_phases = ', '.join(f'Phase {phase}' for phase in course['search_phases'])
+        candidate_phases = []
+        for phase_name in PHASE_INSTRUCTOR_MAPPING:
+            if survey_can_match(course['search_phases'], phase_name):
+                candidate_phases.append(phase_name)
+            else:
+                prune_unit(course, phase_name, f"found by '{search_phases}' search")
+        if not candidate_phases:
+            continue
+        assignments = get_course_assignments(course['id'])
+        for phase_name in candidate_phases:
+            target_assignment = next(
+                (a for a in assignments if a['name'] == phase_name), None)
+            if not target_assignment:
+                prune_unit(course, phase_name, 'survey not in course')
+                continue
+            add_unit(course, phase_name, target_assignment['id'], None)
+
+    units.sort(key=lambda unit: unit['cost'])
+    return units, pruned
+
+
+def print_work_plan(units, pruned):
+    """
+    Print the planned and pruned work units of a plan for a dry run.
+
+    Args:
+        units (list): The work units returned by build_work_plan().
+        pruned (list): The pruned units returned by build_work_plan().
+
+    Returns:
+        None
+    """
+    for unit in units:
+        source = (f"blueprint {unit['blueprint_course']}" if unit['blueprint_course']
+                  else 'no blueprint')
+        cost = unit['cost'] if unit['cost_known'] else f"~{unit['cost']}"
+        print(f"{cost:>5}  {unit['course_id']:>6}  {unit['phase_name']}"
+              f"  ({unit['course_name']}, {source})")
+    for unit in pruned:
+        print(f"pruned  {unit['course_id']:>6}  {unit['phase_name']}"
+              f"  ({unit['course_name']}: {unit['reason']})")
+    total_cost = sum(unit['cost'] for unit in units)
+    unknown = sum(1 for unit in units if not unit['cost_known'])
+    print(f"{len(units)} units planned, {len(pruned)} pruned, {total_cost} Canvas requests "
+          f"({unknown} units assume {DEFAULT_COURSE_SIZE} students).")
+
+
+def get_peak_rss_mb():
+    """
+    Get the peak resident set size of the process so far.
+
+    Returns:
+        float: The peak RSS in megabytes, or None where the resource module is unavailable.
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def main(dry_run=False, low_memory=False, spill_threshold=DEDUP_SPILL_THRESHOLD):
     """
     Entry point for the script to retrieve and process student data from Canvas 
     and append it to a Google Sheet.
 
     This function:
-        1. Authenticates the user with the Google API and refreshes the access token if necessary.
-        2. Loops through blueprint courses and their associated courses, 
-        as well as courses that don't have an associated blueprint.
+        1. Plans the (course, phase) work units from blueprint courses and their associated
+        courses, as well as courses that don't have an associated blueprint. Survey
+        assignments of associated courses are looked up in the assignment index.
+        2. Authenticates the user with the Google API and refreshes the access token if necessary.
         3. Retrieves students who completed a specific assignment with a specified score 
         within a given number of days.
         4. Updates the instructor name for each student based on the phase of the course.
         5. Appends the non-duplicate student data to the specified Google Sheet.
 
+    Every finished (course, phase) unit is recorded in the progress journal. If a
+    previous run was interrupted, its completed units are reused instead of being
+    fetched from Canvas again and the instructor rotation continues where it stopped.
+
+    Args:
+        dry_run (bool): Print the work plan and exit without querying students
+        or touching the Google Sheet.
+        low_memory (bool): Stream rosters and the existing sheet instead of holding them
+        in memory, and read qualified students back from the progress journal instead
+        of collecting them in all_students.
+        spill_threshold (int): The number of sheet keys held in memory in low-memory mode
+        before they are moved to disk.
+
     Returns:
         None
     """
 
+    with trace_span('plan'):
+        units, pruned = build_work_plan(load_assignment_index(), save_index=not dry_run)
+    if dry_run:
+        print_work_plan(units, pruned)
+        return
+
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -415,43 +1500,87 @@ def main():
                            'Nancy Noyes', 'Aastha Saxena', 'Enoch Griffith',
                             'Benjamin Aschenbrenner']
     phase_2_counter, phase_5_counter = get_counters()
-    for blueprint_course in BLUEPRINT_COURSES:
-        # print(f"Processing blueprint course: {blueprint_course}")
-        associated_courses = get_associated_courses(blueprint_course)
-        for course in associated_courses:
-            # print(f"Processing course ID: {course['id']}")
-            for phase_name, instructor_mapping in PHASE_INSTRUCTOR_MAPPING.items():
-                students = get_students_with_assignment(
-                    course['id'], phase_name, 1, 7)
-                for student in students:
-                    if phase_name == '[Flex] Student Survey for Phase 1':
-                        # Use mod 2 counter for Phase 2 to alternate between instructors
-                        new_instructor_name = phase_2_instructors[phase_2_counter % len(
-                            phase_2_instructors)]
-                        phase_2_counter += 1
-                    elif phase_name == '[Flex] Student Survey for Phase 4':
-                        new_instructor_name = phase_5_instructors[phase_5_counter % len(
-                            phase_5_instructors)]
-                        phase_5_counter += 1
-                    else:
-                        new_instructor_name = instructor_mapping['new_instructor']
-                    student["new_instructor_name"] = new_instructor_name
-                    all_students.extend([student])
-
-    # Process courses without blueprint
-    course_ids = get_courses_without_blueprint()
-    for course_id in course_ids:
-        print(f"Processing course ID: {course_id}")
-        new_instructor_name = COURSE_INSTRUCTOR_MAPPING.get(course_id, 'Unknown Instructor')
-        for phase_name, _ in PHASE_INSTRUCTOR_MAPPING.items():
+    run_date = datetime.date.today().strftime('%Y-%m-%d')
+    completed_units, journal_counters = load_progress_journal(run_date, not low_memory)
+    if journal_counters is not None:
+        print(f"Resuming interrupted run: {len(completed_units)} units already done")
+        phase_2_counter, phase_5_counter = journal_counters
+    for unit in units:
+        course_id = unit['course_id']
+        phase_name = unit['phase_name']
+        unit_key = progress_unit_key(course_id, phase_name)
+        if unit_key in completed_units:
+            if not low_memory:
+                all_students.extend(completed_units[unit_key])
+            continue
+        with trace_span(f'course {course_id}', course_id=course_id, phase=phase_name):
             students = get_students_with_assignment(
-                course_id, phase_name, 1, 7)
+                course_id, phase_name, 1, 7, unit['assignment_id'], low_memory)
             for student in students:
+                if unit['blueprint_course'] is None:
+                    # Courses without blueprint keep their own instructor
+                    new_instructor_name = COURSE_INSTRUCTOR_MAPPING.get(
+                        course_id, 'Unknown Instructor')
+                elif phase_name == '[Flex] Student Survey for Phase 1':
+                    # Use mod 2 counter for Phase 2 to alternate between instructors
+                    new_instructor_name = phase_2_instructors[phase_2_counter % len(
+                        phase_2_instructors)]
+                    phase_2_counter += 1
+                elif phase_name == '[Flex] Student Survey for Phase 4':
+                    new_instructor_name = phase_5_instructors[phase_5_counter % len(
+                        phase_5_instructors)]
+                    phase_5_counter += 1
+                else:
+                    new_instructor_name = PHASE_INSTRUCTOR_MAPPING[phase_name]['new_instructor']
                 student["new_instructor_name"] = new_instructor_name
-            all_students.extend(students)
-    append_to_google_sheet(all_students, creds)
+            if not low_memory:
+                all_students.extend(students)
+            record_progress(unit_key, run_date, students, phase_2_counter, phase_5_counter)
+    if low_memory:
+        # The journal already holds every qualified student on disk
+        all_students = iter_journal_students()
+    with trace_span('append_to_google_sheet', 'sheets'):
+        append_to_google_sheet(all_students, creds, low_memory, spill_threshold)
     save_counters(phase_2_counter, phase_5_counter)
+    clear_progress_journal()
+
+    peak_rss = get_peak_rss_mb()
+    if peak_rss is not None:
+        print(f'Peak RSS: {peak_rss:.1f} MB')
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the planned (course, phase) work units and exit')
+    parser.add_argument('--trace', nargs='?', const='trace.json', metavar='FILE',
+                        help='write a Chrome Trace Event / Perfetto timeline of the run '
+                             '(default: trace.json)')
+    parser.add_argument('--profile', nargs='?', const='profile.out', metavar='FILE',
+                        help='run under cProfile and dump the stats (default: profile.out)')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='stream rosters and the sheet and spill dedup keys to disk')
+    parser.add_argument('--spill-threshold', type=int, default=DEDUP_SPILL_THRESHOLD,
+                        metavar='KEYS',
+                        help='sheet keys kept in memory before spilling in --low-memory mode '
+                             f'(default: {DEDUP_SPILL_THRESHOLD})')
+    args = parser.parse_args()
+    run_options = {
+        'dry_run': args.dry_run,
+        'low_memory': args.low_memory,
+        'spill_threshold': args.spill_threshold
+    }
+    if args.trace:
+        start_trace()
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        if profiler:
+            profiler.runcall(main, **run_options)
+        else:
+            main(**run_options)
+    finally:
+        if profiler:
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+        if args.trace:
+            write_trace(args.trace)